@@ -4,23 +4,26 @@ Meta AI System - Unified Production Ready
 Simple, clean implementation for multi-domain analysis with document generation
 """
 
-import os
-import json
 import logging
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dataclasses import dataclass, asdict
-from typing import Dict, List, Any, Optional
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Any, Tuple
+
+import orjson
+import requests
 
 # LangChain Ollama integration
 from langchain_ollama import OllamaLLM
-from langchain_core.prompts import PromptTemplate
 
 # Document generation
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
-import json
+from xml.sax.saxutils import escape
 
 # ============================================================================
 # SETUP
@@ -46,6 +49,11 @@ class Config:
     base_url: str = "http://localhost:11434"
     temperature: float = 0.7
     timeout: int = 60
+    keep_alive: str = "30m"  # how long Ollama keeps the model loaded between calls
+    num_ctx: int = 4096  # context window; changing it makes Ollama reload the model
+    formats: Tuple[str, ...] = ("pdf", "json")  # keys of OUTPUT_GENERATORS
+    result_cache_size: int = 0  # completed queries kept for reuse; 0 (default) disables
+    batch_experts: bool = False  # ask for all domain analyses in one JSON-mode call
 
 # ============================================================================
 # DATA STRUCTURES
@@ -71,72 +79,131 @@ class SystemState:
     workflow_plan: str = ""
     outputs: Dict[str, Any] = None
     session_id: str = ""
+    created_at: datetime = None
     
     def __post_init__(self):
         if self.analyses is None:
             self.analyses = {}
         if self.outputs is None:
             self.outputs = {}
+        # One clock read per request, shared by the session id and every output
+        if self.created_at is None:
+            self.created_at = datetime.now()
         if not self.session_id:
-            self.session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.session_id = f"session_{self.created_at.strftime('%Y%m%d_%H%M%S')}"
 
 # ============================================================================
 # LLM MANAGER
 # ============================================================================
 
+@lru_cache(maxsize=8)
+def check_ollama(base_url: str, model: str) -> None:
+    """Verify Ollama is up and has the model pulled (cached per server and model)"""
+    response = requests.get(f"{base_url}/api/tags", timeout=5)
+    response.raise_for_status()
+    names = [m["name"] for m in response.json().get("models", [])]
+    # Exact match, or a bare model name against any of its tags (llama3.2 -> llama3.2:latest),
+    # so llama3.2 is not satisfied by llama3.2-vision
+    if not any(name == model or name.split(":")[0] == model for name in names):
+        raise ValueError(f"Model {model} not found on {base_url}")
+
+def warm_model(config: Config) -> None:
+    """Load the model with the same options the LLM will use so the first query skips the load"""
+    # A generate request without a prompt only loads the model
+    response = requests.post(
+        f"{config.base_url}/api/generate",
+        json={
+            "model": config.model,
+            "keep_alive": config.keep_alive,
+            "options": {"num_ctx": config.num_ctx},
+        },
+        timeout=config.timeout,
+    )
+    response.raise_for_status()
+
+# Static instructions lead every prompt and the per-call parts come last, so
+# consecutive calls share a byte-identical prefix that Ollama's prompt cache
+# can reuse while the model stays loaded (Config.keep_alive). Keep anything
+# that varies per call (domain, query, analyses, timestamps) out of these.
+ANALYSIS_PREFIX = """You are a domain expert. Analyze the request below from the perspective
+of the given engineering domain and provide:
+1. Key findings
+2. Recommendations
+3. Next steps
+
+Provide a concise, professional analysis."""
+
+WORKFLOW_PREFIX = """Given the domain analyses below, create a workflow plan for the original request.
+
+Provide a clear, step-by-step workflow plan."""
+
+BATCH_ANALYSIS_PROMPT = """You are a panel of domain experts: {domains}.
+
+For each domain, analyze this request and provide:
+1. Key findings
+2. Recommendations
+3. Next steps
+
+Request: {query}
+
+Respond with a JSON object whose keys are the domain names exactly as listed above
+and whose values are that domain's concise, professional analysis as a single string."""
+
 class LLMManager:
     """Manages Ollama LLM interactions"""
     
     def __init__(self, config: Config = None):
         self.config = config or Config()
         self.llm = self._create_llm()
+        self.json_llm = None  # JSON-mode client, created on first batched call
+    
+    def _ollama(self, **options) -> OllamaLLM:
+        """Build a client for the configured model and runner options"""
+        return OllamaLLM(
+            model=self.config.model,
+            base_url=self.config.base_url,
+            temperature=self.config.temperature,
+            keep_alive=self.config.keep_alive,
+            num_ctx=self.config.num_ctx,
+            **options
+        )
     
     def _create_llm(self) -> OllamaLLM:
         """Create and test LLM connection"""
         try:
-            llm = OllamaLLM(
-                model=self.config.model,
-                base_url=self.config.base_url,
-                temperature=self.config.temperature
-            )
-            test = llm.invoke("Hello")
-            if test:
-                logger.info(f"✅ Connected to {self.config.model}")
-                return llm
-            else:
-                raise ValueError("No response from model")
+            llm = self._ollama()
+            check_ollama(self.config.base_url, self.config.model)
+            warm_model(self.config)
+            logger.info("✅ Connected to %s", self.config.model)
+            return llm
         except Exception as e:
-            logger.error(f"❌ Failed to connect to Ollama: {e}")
+            logger.error("❌ Failed to connect to Ollama: %s", e)
             logger.error("Ensure: 1) ollama serve is running 2) ollama pull llama3.2")
             raise
     
     def analyze(self, domain: str, query: str) -> str:
         """Run domain analysis"""
-        prompt = f"""You are a {domain} domain expert. 
-        
-Analyze this request and provide:
-1. Key findings
-2. Recommendations
-3. Next steps
-
-Request: {query}
-
-Provide a concise, professional analysis."""
-        
+        prompt = f"{ANALYSIS_PREFIX}\n\nDomain: {domain}\n\nRequest: {query}"
         return self.llm.invoke(prompt)
     
+    def analyze_batch(self, domains: List[str], query: str) -> Dict[str, str]:
+        """Run several domain analyses in one JSON-mode call; unanswered domains are omitted"""
+        if self.json_llm is None:
+            self.json_llm = self._ollama(format="json")
+        prompt = BATCH_ANALYSIS_PROMPT.format(domains=", ".join(domains), query=query)
+        reply = orjson.loads(self.json_llm.invoke(prompt))
+        if not isinstance(reply, dict):
+            return {}
+        return {
+            domain: reply[domain]
+            for domain in domains
+            if isinstance(reply.get(domain), str) and reply[domain].strip()
+        }
+    
     def create_workflow(self, query: str, analyses: Dict[str, str]) -> str:
         """Create workflow plan from analyses"""
         analysis_text = "\n".join([f"{k}: {v}" for k, v in analyses.items()])
-        
-        prompt = f"""Given these domain analyses, create a workflow plan:
-
-{analysis_text}
-
-Original request: {query}
-
-Provide a clear, step-by-step workflow plan."""
-        
+        prompt = f"{WORKFLOW_PREFIX}\n\nOriginal request: {query}\n\nDomain analyses:\n{analysis_text}"
         return self.llm.invoke(prompt)
 
 # ============================================================================
@@ -152,8 +219,10 @@ class DomainExpert:
     
     def analyze(self, query: str) -> DomainAnalysis:
         """Perform domain analysis"""
-        analysis_text = self.llm.analyze(self.domain, query)
-        
+        return self.from_text(self.llm.analyze(self.domain, query))
+    
+    def from_text(self, analysis_text: str) -> DomainAnalysis:
+        """Wrap analysis text produced for this domain"""
         return DomainAnalysis(
             domain=self.domain,
             analysis=analysis_text,
@@ -167,6 +236,21 @@ class DomainExpert:
 class PDFGenerator:
     """Generate PDF reports"""
     
+    # Sample stylesheet, built on first use and shared by every report
+    _styles = None
+    
+    @classmethod
+    def _stylesheet(cls):
+        """Return the shared sample stylesheet"""
+        if cls._styles is None:
+            cls._styles = getSampleStyleSheet()
+        return cls._styles
+    
+    @staticmethod
+    def _markup(text: str) -> str:
+        """Escape LLM text for ReportLab markup, keeping its line breaks in one paragraph"""
+        return "<br/>".join(escape(line) for line in text.splitlines())
+    
     @staticmethod
     def generate(state: SystemState, output_path: str = None):
         """Generate PDF from system state"""
@@ -174,30 +258,33 @@ class PDFGenerator:
             output_path = DATA_DIR / f"report_{state.session_id}.pdf"
         
         doc = SimpleDocTemplate(str(output_path), pagesize=letter)
-        styles = getSampleStyleSheet()
+        styles = PDFGenerator._stylesheet()
+        title_style = styles['Title']
+        heading_style = styles['Heading2']
+        normal_style = styles['Normal']
         story = []
         
         # Title
-        story.append(Paragraph(f"Analysis Report", styles['Title']))
+        story.append(Paragraph(f"Analysis Report", title_style))
         story.append(Spacer(1, 0.2))
         
         # Query
-        story.append(Paragraph(f"<b>Query:</b> {state.user_query}", styles['Normal']))
+        story.append(Paragraph(f"<b>Query:</b> {escape(state.user_query)}", normal_style))
         story.append(Spacer(1, 0.2))
         
         # Analyses
         for domain, analysis in state.analyses.items():
-            story.append(Paragraph(f"<b>{domain}:</b>", styles['Heading2']))
-            story.append(Paragraph(analysis.analysis, styles['Normal']))
+            story.append(Paragraph(f"<b>{escape(domain)}:</b>", heading_style))
+            story.append(Paragraph(PDFGenerator._markup(analysis.analysis), normal_style))
             story.append(Spacer(1, 0.1))
         
         # Workflow
         if state.workflow_plan:
-            story.append(Paragraph("<b>Workflow Plan:</b>", styles['Heading2']))
-            story.append(Paragraph(state.workflow_plan, styles['Normal']))
+            story.append(Paragraph("<b>Workflow Plan:</b>", heading_style))
+            story.append(Paragraph(PDFGenerator._markup(state.workflow_plan), normal_style))
         
         doc.build(story)
-        logger.info(f"✅ PDF saved: {output_path}")
+        logger.info("✅ PDF saved: %s", output_path)
         return output_path
 
 class JSONGenerator:
@@ -217,15 +304,20 @@ class JSONGenerator:
                 for k, v in state.analyses.items()
             },
             "workflow": state.workflow_plan,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": state.created_at.isoformat()
         }
         
-        with open(output_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        Path(output_path).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         
-        logger.info(f"✅ JSON saved: {output_path}")
+        logger.info("✅ JSON saved: %s", output_path)
         return output_path
 
+# Output format -> generator; Config.formats picks which ones run
+OUTPUT_GENERATORS = {
+    "pdf": PDFGenerator.generate,
+    "json": JSONGenerator.generate,
+}
+
 # ============================================================================
 # MAIN SYSTEM
 # ============================================================================
@@ -242,21 +334,33 @@ class MetaAISystem:
             "Software": DomainExpert("Software Engineering", self.llm_manager),
         }
         self.state = None
+        self._results: "OrderedDict[str, SystemState]" = OrderedDict()
     
-    def process(self, query: str) -> SystemState:
-        """Process user query through all domains"""
-        logger.info(f"Processing: {query}")
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Case- and whitespace-insensitive cache key for a query"""
+        return " ".join(query.lower().split())
+    
+    def process(self, query: str, use_cache: bool = True) -> SystemState:
+        """Process user query through all domains; use_cache=False forces a fresh run"""
+        cache_key = self._normalize_query(query)
+        cached = self._results.get(cache_key) if use_cache else None
+        if cached is not None and not self._outputs_exist(cached):
+            logger.info("Output files of session %s are gone, rerunning: %s", cached.session_id, query)
+            del self._results[cache_key]
+            cached = None
+        if cached is not None:
+            self._results.move_to_end(cache_key)
+            logger.info("⚡ Reusing result of session %s for: %s", cached.session_id, query)
+            self.state = cached
+            return cached
+        
+        logger.info("Processing: %s", query)
         self.state = SystemState(user_query=query)
         
         # Run domain analyses
         logger.info("Running domain analyses...")
-        for domain, expert in self.experts.items():
-            try:
-                analysis = expert.analyze(query)
-                self.state.analyses[domain] = analysis
-                logger.info(f"✅ {domain} analysis complete")
-            except Exception as e:
-                logger.error(f"❌ {domain} analysis failed: {e}")
+        self.state.analyses = self._run_experts(query)
         
         # Create workflow
         logger.info("Creating workflow plan...")
@@ -269,14 +373,76 @@ class MetaAISystem:
             )
             logger.info("✅ Workflow created")
         except Exception as e:
-            logger.error(f"❌ Workflow creation failed: {e}")
+            logger.error("❌ Workflow creation failed: %s", e)
         
         # Generate outputs
         logger.info("Generating output documents...")
-        PDFGenerator.generate(self.state)
-        JSONGenerator.generate(self.state)
+        self.state.outputs.update(self._generate_outputs())
         
+        self._remember(cache_key)
         return self.state
+    
+    def _run_experts(self, query: str) -> Dict[str, DomainAnalysis]:
+        """Analyze the query in every domain, keyed and ordered like self.experts"""
+        analyses = self._run_batched(query) if self.config.batch_experts else {}
+        
+        # Each remaining expert is an independent Ollama round trip
+        pending = {domain: expert for domain, expert in self.experts.items() if domain not in analyses}
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                futures = {
+                    domain: pool.submit(expert.analyze, query)
+                    for domain, expert in pending.items()
+                }
+            for domain, future in futures.items():
+                try:
+                    analyses[domain] = future.result()
+                    logger.info("✅ %s analysis complete", domain)
+                except Exception as e:
+                    logger.error("❌ %s analysis failed: %s", domain, e)
+        
+        return {domain: analyses[domain] for domain in self.experts if domain in analyses}
+    
+    def _run_batched(self, query: str) -> Dict[str, DomainAnalysis]:
+        """One JSON-mode call for all experts; returns only the domains it answered"""
+        try:
+            texts = self.llm_manager.analyze_batch(
+                [expert.domain for expert in self.experts.values()], query
+            )
+        except Exception as e:
+            logger.warning("Batched analysis failed, falling back to per-expert calls: %s", e)
+            return {}
+        
+        analyses = {}
+        for domain, expert in self.experts.items():
+            if expert.domain in texts:
+                analyses[domain] = expert.from_text(texts[expert.domain])
+                logger.info("✅ %s analysis complete (batched)", domain)
+        return analyses
+    
+    def _remember(self, cache_key: str):
+        """Keep a fully successful result for repeats of the same query"""
+        if self.config.result_cache_size <= 0:
+            return
+        if len(self.state.analyses) < len(self.experts) or not self.state.workflow_plan:
+            return
+        self._results[cache_key] = self.state
+        if len(self._results) > self.config.result_cache_size:
+            self._results.popitem(last=False)
+    
+    @staticmethod
+    def _outputs_exist(state: SystemState) -> bool:
+        """Whether every output document of a cached result is still on disk"""
+        return all(Path(path).exists() for path in state.outputs.values())
+    
+    def _generate_outputs(self) -> Dict[str, Any]:
+        """Write the configured output documents concurrently"""
+        generators = {fmt: OUTPUT_GENERATORS[fmt] for fmt in self.config.formats}
+        if not generators:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(generators)) as pool:
+            futures = {name: pool.submit(generate, self.state) for name, generate in generators.items()}
+        return {name: future.result() for name, future in futures.items()}
 
 # ============================================================================
 # CLI
@@ -286,18 +452,22 @@ def main():
     """Command-line interface"""
     import sys
     
+    args = sys.argv[1:]
+    # --fresh skips reuse of earlier results for repeated queries
+    fresh = "--fresh" in args
+    args = [arg for arg in args if arg != "--fresh"]
+    
     config = Config()
     system = MetaAISystem(config)
     
-    if len(sys.argv) > 1:
+    if args:
         # Process argument as query
-        query = " ".join(sys.argv[1:])
-        result = system.process(query)
+        query = " ".join(args)
+        result = system.process(query, use_cache=not fresh)
         print(f"\n✅ Analysis complete. Session: {result.session_id}")
     else:
         # Interactive mode
-        print("\n🤖 Meta AI System - Interactive Mode")
-        print("Type 'exit' to quit\n")
+        print("\n🤖 Meta AI System - Interactive Mode\nType 'exit' to quit\n")
         
         while True:
             try:
@@ -305,7 +475,7 @@ def main():
                 if query.lower() in ["exit", "quit"]:
                     break
                 if query:
-                    result = system.process(query)
+                    result = system.process(query, use_cache=not fresh)
                     print(f"✅ Session: {result.session_id}\n")
             except KeyboardInterrupt:
                 print("\nExiting...")